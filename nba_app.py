@@ -1,11 +1,20 @@
 import streamlit as st
 import pandas as pd
-import requests
+import numpy as np
+import requests_cache
+import os
 import time
-from io import StringIO
+import threading
+import pickle
+import tempfile
+import functools
+import re
 from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
 import google.generativeai as genai
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import warnings
+from selectolax.lexbor import LexborHTMLParser
 
 # Suppress FutureWarnings to keep logs clean
 warnings.simplefilter(action='ignore', category=FutureWarning)
@@ -19,6 +28,7 @@ from nba_api.stats.endpoints import (
     scoreboardv2
 )
 from nba_api.stats.static import players, teams as static_teams
+from nba_api.stats.library.http import NBAStatsHTTP
 
 # --- PAGE CONFIGURATION ---
 st.set_page_config(page_title="CourtVision AI", page_icon="🧠", layout="wide")
@@ -73,26 +83,33 @@ def get_current_season():
 
 current_season_str = get_current_season()
 
-# --- HELPER: DATA SCRUBBER ---
-def clean_id(obj):
-    """Forces any ID to a clean string."""
-    try:
-        return str(int(float(obj)))
-    except:
-        return str(obj)
+# --- HELPER: NAME JOIN KEY ---
+def name_key(names):
+    """Normalizes a Series of player names into a join key (lowercase, no periods)."""
+    return names.astype(str).str.lower().str.replace('.', '', regex=False).str.strip()
 
 # --- CONFIGURE GEMINI with error handling ---
 gemini_model = None
 gemini_error = None
 
+# Model preference, highest first: flash 1.5 > pro 1.5 > any gemini
+GEMINI_MODEL_PATTERNS = [re.compile(r'flash.*1\.5|1\.5.*flash'), re.compile(r'pro.*1\.5|1\.5.*pro'), re.compile(r'gemini')]
+
+def model_rank(name):
+    return next((i for i, pat in enumerate(GEMINI_MODEL_PATTERNS) if pat.search(name)), len(GEMINI_MODEL_PATTERNS))
+
+@st.cache_resource(ttl=3600)
+def get_gemini_model():
+    """Lists models once per hour (not on every rerun) and picks the best-ranked one in a single scan."""
+    available_models = [m.name for m in genai.list_models() if 'generateContent' in m.supported_generation_methods]
+    best = min(available_models, key=model_rank, default=None)
+    return genai.GenerativeModel(best) if best else None
+
 try:
     if "GOOGLE_API_KEY" in st.secrets and st.secrets["GOOGLE_API_KEY"]:
         genai.configure(api_key=st.secrets["GOOGLE_API_KEY"])
-        # Try to list models to verify key works
-        available_models = [m.name for m in genai.list_models() if 'generateContent' in m.supported_generation_methods]
-        if available_models:
-            gemini_model = genai.GenerativeModel(available_models[0])  # Use first available (e.g. flash)
-        else:
+        gemini_model = get_gemini_model()
+        if gemini_model is None:
             gemini_error = "No generative models available with this key."
     else:
         gemini_error = "GOOGLE_API_KEY missing or empty in secrets."
@@ -128,6 +145,119 @@ st.markdown("""
   }
 </script>
 """, unsafe_allow_html=True)
+# --- HTTP CACHE (persists across restarts, sits under st.cache_data) ---
+@st.cache_resource
+def get_http_session():
+    """One process-wide session: keep-alive connections are reused by nba_api and the CBS scrape."""
+    # HTTP expiry mirrors each loader's st.cache_data ttl, so a refresh never gets an older response
+    session = requests_cache.CachedSession(
+        'nba_cache',
+        backend='sqlite',
+        serializer='json',  # not pickle: the SQLite file sits in the launch dir, so never unpickle from it
+        expire_after=600,
+        urls_expire_after={
+            'stats.nba.com/stats/leaguedashplayerstats': 600,
+            'stats.nba.com/stats/scoreboardv2': 900,
+            'stats.nba.com/stats/leaguedashteamstats': 86400,
+            'www.cbssports.com/nba/injuries': 3600,
+        },
+    )
+    session.headers.update({"User-Agent": "Mozilla/5.0"})
+    return session
+
+http_session = get_http_session()
+NBAStatsHTTP.set_session(http_session)  # route every nba_api endpoint through the cache
+
+# --- CIRCUIT BREAKER (stop hammering stats.nba.com / CBS while they are down) ---
+NBA_TIMEOUT = 10          # seconds per request (nba_api default is 30)
+CIRCUIT_FAILURES = 3      # consecutive failures before the circuit opens
+CIRCUIT_COOLDOWN = 300    # seconds to stay open before trying again
+
+@st.cache_resource
+def get_circuit_state():
+    """Process-wide ({key: (consecutive_failures, reopen_ts)}, lock), shared across reruns, sessions and threads."""
+    return {}, threading.Lock()
+
+def circuit_call(name, fn):
+    """Runs fn() under the named circuit breaker; raises without calling it while the circuit is open.
+
+    Calls that can run concurrently need distinct names.
+    """
+    state, lock = get_circuit_state()
+    with lock:
+        failures, reopen_ts = state.get(name, (0, 0.0))
+        if failures >= CIRCUIT_FAILURES and time.time() < reopen_ts:
+            raise RuntimeError(f"{name} unavailable (circuit open, retrying in <{CIRCUIT_COOLDOWN // 60} min)")
+    try:
+        result = fn()
+    except Exception:
+        with lock:
+            state[name] = (state.get(name, (0, 0.0))[0] + 1, time.time() + CIRCUIT_COOLDOWN)
+        raise
+    with lock:
+        state.pop(name, None)
+    return result
+
+def fetch_nba(endpoint_cls, circuit_key=None, **kwargs):
+    """Calls an nba_api endpoint with a short timeout behind the circuit breaker and returns its first frame."""
+    return circuit_call(
+        circuit_key or endpoint_cls.__name__,
+        lambda: endpoint_cls(timeout=NBA_TIMEOUT, **kwargs).get_data_frames()[0]
+    )
+
+def fetch_cbs(url):
+    """GETs a CBS page with a short timeout behind the circuit breaker; HTTP errors count as failures."""
+    def get():
+        response = http_session.get(url, timeout=NBA_TIMEOUT)
+        response.raise_for_status()
+        return response
+    return circuit_call('cbs_injuries', get)
+
+# --- DISK CACHE (second layer under st.cache_data, survives worker restarts) ---
+# App-owned and private (0700): we unpickle from here, so no other local user may write into it
+DISK_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "courtvision")
+try:
+    os.makedirs(DISK_CACHE_DIR, mode=0o700, exist_ok=True)
+    os.chmod(DISK_CACHE_DIR, 0o700)
+except OSError:
+    DISK_CACHE_DIR = None  # no writable home - run on st.cache_data alone
+
+def disk_cache(ttl):
+    """Pickles a function's result to DISK_CACHE_DIR and reuses it for `ttl` seconds.
+
+    Wrapped loaders must raise on failure - whatever they return is stored.
+    A no-op when DISK_CACHE_DIR is unavailable; write errors are ignored.
+    """
+    def deco(fn):
+        if DISK_CACHE_DIR is None:
+            return fn
+        path = os.path.join(DISK_CACHE_DIR, f"{fn.__name__}.pkl")
+
+        @functools.wraps(fn)
+        def wrapped(*args, **kwargs):
+            try:
+                if time.time() - os.path.getmtime(path) < ttl:
+                    with open(path, 'rb') as f:
+                        return pickle.load(f)
+            except Exception:
+                pass  # missing, expired or unreadable - recompute
+            value = fn(*args, **kwargs)
+            try:
+                fd, tmp_path = tempfile.mkstemp(dir=DISK_CACHE_DIR, suffix='.tmp')
+                with os.fdopen(fd, 'wb') as f:
+                    pickle.dump(value, f, protocol=5)
+                os.replace(tmp_path, path)  # atomic, so readers never see a half-written file
+            except OSError:
+                pass  # disk full / dir removed - the value is still served from st.cache_data
+            return value
+        return wrapped
+    return deco
+
+def clear_disk_cache():
+    if DISK_CACHE_DIR and os.path.isdir(DISK_CACHE_DIR):
+        for name in os.listdir(DISK_CACHE_DIR):
+            os.remove(os.path.join(DISK_CACHE_DIR, name))
+
 # --- CACHED FUNCTIONS ---
 @st.cache_data(ttl=900)
 def get_team_map_v4():
@@ -137,122 +267,191 @@ def get_team_map_v4():
     except:
         return {}
 
+# load_* functions raise on failure so st.cache_data / disk_cache never store a fallback;
+# the matching get_* wrapper supplies the fallback uncached (the circuit breaker limits retries).
 @st.cache_data(ttl=3600)
-def get_live_injuries_v4():
+@disk_cache(ttl=3600)
+def load_live_injuries_v4():
     url = "https://www.cbssports.com/nba/injuries/"
-    headers = {"User-Agent": "Mozilla/5.0"}
+    response = fetch_cbs(url)
+    # Hand the raw bytes to the parser - skips requests' charset sniffing and str decode
+    tree = LexborHTMLParser(response.content)
+    injuries = {}
+    found_table = False
+    for tbl in tree.css('table'):
+        headers_row = [th.text(strip=True) for th in tbl.css('thead th')]
+        if 'Player' not in headers_row or 'Injury Status' not in headers_row:
+            continue
+        found_table = True
+        name_idx = headers_row.index('Player')
+        status_idx = headers_row.index('Injury Status')
+        for tr in tbl.css('tbody tr'):
+            tds = tr.css('td')
+            if len(tds) <= max(name_idx, status_idx):
+                continue
+            # CBS renders both an abbreviated and a full name - keep the full one
+            name_node = tds[name_idx].css_first('.CellPlayerName--long') or tds[name_idx]
+            injuries[name_node.text(separator=' ', strip=True)] = tds[status_idx].text(strip=True)
+    if not found_table:
+        raise ValueError("No injury tables found on the CBS page")
+    return injuries
+
+def get_live_injuries_v4():
     try:
-        response = requests.get(url, headers=headers)
-        tables = pd.read_html(StringIO(response.text))
-        injuries = {}
-        for df in tables:
-            if 'Player' in df.columns:
-                for _, row in df.iterrows():
-                    name = str(row['Player']).strip()
-                    status = str(row['Injury Status'])
-                    injuries[name] = status
-        return injuries
-    except:
+        return load_live_injuries_v4()
+    except Exception:
         return {}
 
+@st.cache_data(ttl=3600)
+def get_injuries_frame_v4(injuries):
+    inj_df = pd.DataFrame({'name': list(injuries.keys()), 'status': list(injuries.values())}, dtype=object)
+    inj_df['key'] = name_key(inj_df['name'])
+    return inj_df
+
 @st.cache_data(ttl=86400)
+@disk_cache(ttl=86400)
+def load_defensive_rankings_v4():
+    teams_data = fetch_nba(
+        leaguedashteamstats.LeagueDashTeamStats,
+        season=current_season_str,
+        measure_type_detailed_defense='Advanced'
+    )
+    teams_data = teams_data[['TEAM_ID', 'TEAM_NAME', 'DEF_RATING']].sort_values(by='DEF_RATING', ascending=False)
+    ids = teams_data['TEAM_ID'].astype('int32').tolist()
+    return {
+        tid: {'Team': name, 'Rating': rating}
+        for tid, name, rating in zip(ids, teams_data['TEAM_NAME'].values, teams_data['DEF_RATING'].values)
+    }
+
 def get_defensive_rankings_v4():
-    defense_map = {}
     try:
-        teams_data = leaguedashteamstats.LeagueDashTeamStats(
-            season=current_season_str,
-            measure_type_detailed_defense='Advanced'
-        ).get_data_frames()[0]
-        teams_data = teams_data.sort_values(by='DEF_RATING', ascending=False)
-        for _, row in teams_data.iterrows():
-            clean_team_id = clean_id(row['TEAM_ID'])
-            defense_map[clean_team_id] = {
-                'Team': row['TEAM_NAME'],
-                'Rating': row['DEF_RATING']
-            }
-    except Exception as e:
-        nba_teams = static_teams.get_teams()
-        for t in nba_teams:
-            tid = clean_id(t['id'])
-            defense_map[tid] = {'Team': t['abbreviation'], 'Rating': 114.0}
-    return defense_map
+        return load_defensive_rankings_v4()
+    except Exception:
+        return {int(t['id']): {'Team': t['abbreviation'], 'Rating': 114.0} for t in static_teams.get_teams()}
 
 @st.cache_data(ttl=900)
+@disk_cache(ttl=900)
+def load_todays_games_v4():
+    now_utc = datetime.now(timezone.utc)
+    dates = [
+        (now_utc - timedelta(hours=5)).strftime('%m/%d/%Y'),
+        (now_utc + timedelta(hours=19)).strftime('%m/%d/%Y')
+    ]
+    games = {}
+    for d in dates:
+        board = fetch_nba(scoreboardv2.ScoreboardV2, game_date=d)
+        if not board.empty:
+            h = board['HOME_TEAM_ID'].astype('int32').tolist()
+            v = board['VISITOR_TEAM_ID'].astype('int32').tolist()
+            games.update(zip(h, v))
+            games.update(zip(v, h))
+    return games
+
 def get_todays_games_v4():
     try:
-        now_utc = datetime.now(timezone.utc)
-        dates = [
-            (now_utc - timedelta(hours=5)).strftime('%m/%d/%Y'),
-            (now_utc + timedelta(hours=19)).strftime('%m/%d/%Y')
-        ]
-        games = {}
-        for d in dates:
-            board = scoreboardv2.ScoreboardV2(game_date=d).get_data_frames()[0]
-            if not board.empty:
-                for _, row in board.iterrows():
-                    h = clean_id(row['HOME_TEAM_ID'])
-                    v = clean_id(row['VISITOR_TEAM_ID'])
-                    games[h] = v
-                    games[v] = h
-        return games
-    except:
+        return load_todays_games_v4()
+    except Exception:
         return {}
 
+STATUS_LABELS = ["🔥 Super Hot", "🔥 Heating Up", "❄️ Ice Cold", "❄️ Cooling Down", "⚪ Steady"]
+TRENDS_COLS = ['Player', 'Matchup', 'Season PPG', 'Last 5 PPG', 'Season PRA', 'Last 5 PRA', 'PRA Delta', 'Status']
+
+@st.cache_data(ttl=600)
+@disk_cache(ttl=600)
+def load_league_trends_v4():
+    """Player form table (everything but Matchup), sorted by PRA Delta."""
+    with ThreadPoolExecutor(max_workers=2, initializer=add_script_run_ctx, initargs=(None, get_script_run_ctx())) as ex:
+        f_season = ex.submit(fetch_nba, leaguedashplayerstats.LeagueDashPlayerStats, circuit_key='LeagueDashPlayerStats:season', season=current_season_str, per_mode_detailed='PerGame')
+        f_l5 = ex.submit(fetch_nba, leaguedashplayerstats.LeagueDashPlayerStats, circuit_key='LeagueDashPlayerStats:last5', season=current_season_str, per_mode_detailed='PerGame', last_n_games=5)
+        season, l5 = f_season.result(), f_l5.result()
+    # Keep only the columns we use (the endpoints return 60+) and narrow the ID dtypes
+    season = season[['PLAYER_ID', 'PLAYER_NAME', 'TEAM_ID', 'GP', 'PTS', 'REB', 'AST']].astype({'PLAYER_ID': 'int32', 'TEAM_ID': 'int32', 'GP': 'int16'}).set_index('PLAYER_ID')
+    l5 = l5[['PLAYER_ID', 'GP', 'PTS', 'REB', 'AST']].astype({'PLAYER_ID': 'int32', 'GP': 'int16'}).set_index('PLAYER_ID')
+    # Push the GP >= 3 predicate below the join on both sides, so fringe players never enter the join
+    season = season[season['GP'] >= 3].drop(columns='GP')
+    l5 = l5[l5['GP'] >= 3].drop(columns='GP')
+    # Index join on PLAYER_ID (kept as the index for the rest of the pipeline)
+    merged = season.join(l5, how='inner', lsuffix='_Season', rsuffix='_L5')
+    
+    # PRA calculations
+    merged['PRA_Season'] = merged['PTS_Season'] + merged['REB_Season'] + merged['AST_Season']
+    merged['PRA_L5'] = merged['PTS_L5'] + merged['REB_L5'] + merged['AST_L5']
+    merged['PRA Delta'] = merged['PRA_L5'] - merged['PRA_Season']
+    
+    final_df = merged.rename(columns={
+        'PLAYER_NAME': 'Player',
+        'PTS_Season': 'Season PPG',
+        'PTS_L5': 'Last 5 PPG',
+        'PRA_Season': 'Season PRA',
+        'PRA_L5': 'Last 5 PRA',
+        'PRA Delta': 'PRA Delta'
+    })
+    
+    # Classify on the raw array into int8 codes, stored as a Categorical
+    d = final_df['PRA Delta'].to_numpy()
+    status_codes = np.select([d >= 6.0, d >= 3.0, d <= -5.0, d <= -2.0], [0, 1, 2, 3], default=4).astype(np.int8)
+    final_df['Status'] = pd.Categorical.from_codes(status_codes, STATUS_LABELS)
+    
+    return final_df.sort_values(by='PRA Delta', ascending=False)
+
+class MatchupSourcesDown(Exception):
+    """Schedule or defense data failed while the player stats loaded fine."""
+
+def add_matchups(trends, games, defense):
+    """Labels each player's opponent tonight with a soft/avg/tough defense tag."""
+    final_df = trends.copy()
+    opp_ids = final_df['TEAM_ID'].map(games)
+    opp_name = opp_ids.map({k: v['Team'] for k, v in defense.items()})
+    opp_rating = opp_ids.map({k: v['Rating'] for k, v in defense.items()}).astype(float)
+    vs_opp = 'vs ' + opp_name.astype(object)
+    final_df['Matchup'] = np.select(
+        [opp_ids.isna(), opp_rating.isna(), opp_rating > 116.0, opp_rating < 112.0],
+        ["No Game", "vs ???", vs_opp + " (🟢 Soft)", vs_opp + " (🔴 Tough)"],
+        default=vs_opp + " (⚪ Avg)"
+    )
+    return final_df[TRENDS_COLS]
+
 @st.cache_data(ttl=600)
+def build_league_trends_v4():
+    """Trends with matchups; raises if any source failed, so only complete tables are cached."""
+    # The three sources are network-bound and independent - run them concurrently
+    with ThreadPoolExecutor(max_workers=3, initializer=add_script_run_ctx, initargs=(None, get_script_run_ctx())) as ex:
+        f_trends = ex.submit(load_league_trends_v4)
+        f_games = ex.submit(load_todays_games_v4)
+        f_def = ex.submit(load_defensive_rankings_v4)
+        trends = f_trends.result()
+        try:
+            games, defense = f_games.result(), f_def.result()
+        except Exception as e:
+            raise MatchupSourcesDown(str(e)) from e
+    return add_matchups(trends, games, defense)
+
 def get_league_trends_v4():
-    expected_cols = ['Player', 'Matchup', 'Season PPG', 'Last 5 PPG', 'Season PRA', 'Last 5 PRA', 'PRA Delta', 'Status']
     try:
-        season = leaguedashplayerstats.LeagueDashPlayerStats(season=current_season_str, per_mode_detailed='PerGame').get_data_frames()[0]
-        l5 = leaguedashplayerstats.LeagueDashPlayerStats(season=current_season_str, per_mode_detailed='PerGame', last_n_games=5).get_data_frames()[0]
-        l5 = l5[l5['GP'] >= 3]
-        merged = pd.merge(season[['PLAYER_ID', 'PLAYER_NAME', 'TEAM_ID', 'PTS', 'REB', 'AST']],
-                          l5[['PLAYER_ID', 'PTS', 'REB', 'AST']], on='PLAYER_ID', suffixes=('_Season', '_L5'))
-        
-        # PRA calculations
-        merged['PRA_Season'] = merged['PTS_Season'] + merged['REB_Season'] + merged['AST_Season']
-        merged['PRA_L5'] = merged['PTS_L5'] + merged['REB_L5'] + merged['AST_L5']
-        merged['PRA Delta'] = merged['PRA_L5'] - merged['PRA_Season']
-        
-        games = get_todays_games_v4()
-        defense = get_defensive_rankings_v4()
-        
-        def analyze_matchup(row):
-            my_team = clean_id(row['TEAM_ID'])
-            if my_team not in games: return "No Game"
-            opp_id = games[my_team]
-            if opp_id in defense:
-                opp_name = defense[opp_id]['Team']
-                opp_rating = defense[opp_id]['Rating']
-                if opp_rating > 116.0: return f"vs {opp_name} (🟢 Soft)"
-                elif opp_rating < 112.0: return f"vs {opp_name} (🔴 Tough)"
-                else: return f"vs {opp_name} (⚪ Avg)"
-            return "vs ???"
-        
-        merged['Matchup'] = merged.apply(analyze_matchup, axis=1)
-        
-        final_df = merged.rename(columns={
-            'PLAYER_NAME': 'Player',
-            'PTS_Season': 'Season PPG',
-            'PTS_L5': 'Last 5 PPG',
-            'PRA_Season': 'Season PRA',
-            'PRA_L5': 'Last 5 PRA',
-            'PRA Delta': 'PRA Delta'
-        })
-        
-        def get_status(row):
-            d = row['PRA Delta']
-            if d >= 6.0: return "🔥 Super Hot"
-            elif d >= 3.0: return "🔥 Heating Up"
-            elif d <= -5.0: return "❄️ Ice Cold"
-            elif d <= -2.0: return "❄️ Cooling Down"
-            else: return "⚪ Steady"
-        
-        final_df['Status'] = final_df.apply(get_status, axis=1)
-        
-        return final_df[expected_cols].sort_values(by='PRA Delta', ascending=False)
+        return build_league_trends_v4()  # warm reruns stop here - no thread pool, no recompute
+    except MatchupSourcesDown:
+        # Stats are fine (and cached); label matchups from the uncached fallbacks
+        return add_matchups(load_league_trends_v4(), get_todays_games_v4(), get_defensive_rankings_v4())
     except Exception as e:
         st.warning(f"Trends data error: {e}")
-        return pd.DataFrame(columns=expected_cols)
+        return pd.DataFrame(columns=TRENDS_COLS)
+
+@st.cache_data(ttl=600)
+def get_impact_out(trends, injuries):
+    """[(player, status), ...] for 12+ PPG players on the injury report; keyed on its inputs so fallbacks aren't pinned."""
+    if trends.empty:
+        return []
+    impact_df = trends.loc[trends['Season PPG'] > 12, ['Player']]
+    impact_df['key'] = name_key(impact_df['Player'])
+    hits = impact_df.merge(get_injuries_frame_v4(injuries), on='key', how='inner')
+    return list(zip(hits['Player'], hits['status']))
+
+def get_dashboard_bundle():
+    """Sidebar data in one call: (trends, injuries, defense, impact players out)."""
+    trends = get_league_trends_v4()
+    injuries = get_live_injuries_v4()
+    defense = get_defensive_rankings_v4()
+    return trends, injuries, defense, get_impact_out(trends, injuries)
 
 def generate_ai_response(prompt_text):
     if gemini_error:
@@ -266,6 +465,40 @@ def generate_ai_response(prompt_text):
     except Exception as e:
         return f"Gemini error: {str(e)}"
 
+def get_focus_teams(prompt_text, games, defense):
+    """Returns names of teams mentioned in the question plus tonight's opponents."""
+    text = prompt_text.lower()
+    focus = []
+    for t in static_teams.get_teams():
+        # Whole-word match, so "heating" doesn't pick the Heat and "hornets" doesn't pick the Nets
+        if re.search(rf"\b{re.escape(t['nickname'].lower())}\b", text):
+            for tid in (t['id'], games.get(t['id'])):
+                if tid in defense:
+                    focus.append(defense[tid]['Team'])
+    return tuple(sorted(set(focus)))
+
+@st.cache_data(ttl=600)
+def build_chat_context(trends, inj_df, focus_teams=()):
+    """Serializes trends and injuries into a compact prompt block: (trends label, trends CSV, injuries)."""
+    top = trends
+    trends_label = "CSV, league top 25 by PRA Delta"
+    if focus_teams and not trends.empty:
+        focused = trends[trends['Matchup'].str.contains('|'.join(map(re.escape, focus_teams)), na=False)]
+        if not focused.empty:
+            top = focused
+            trends_label = f"CSV, top 25 by PRA Delta in games involving {', '.join(focus_teams)}"
+    top = top.head(25)
+    if top.empty:
+        trends_csv = "No trends data available.\n"
+    else:
+        trends_csv = top[['Player', 'Matchup', 'Season PRA', 'Last 5 PRA', 'PRA Delta', 'Status']].to_csv(index=False, float_format='%.1f')
+    
+    # Injuries for players in the slice go first so they survive the cap (keys are precomputed per cache period)
+    in_slice = inj_df['key'].isin(set(name_key(top['Player']))).to_numpy()
+    inj = pd.concat([inj_df[in_slice], inj_df[~in_slice]]).head(40)
+    injuries_str = "\n".join(f"{k}: {v}" for k, v in zip(inj['name'], inj['status'])) or "No injury data available."
+    return trends_label, trends_csv, injuries_str
+
 # --- MAIN APP LAYOUT ---
 tab1, tab2 = st.tabs(["📊 Dashboard", "🧠 CourtVision IQ"])
 
@@ -276,11 +509,11 @@ with tab1:
         st.header("⚙️ System Status")
         if st.button("🔄 Force Reset Data"):
             st.cache_data.clear()
+            clear_disk_cache()
+            http_session.cache.clear()
             st.rerun()
         
-        injuries = get_live_injuries_v4()
-        trends = get_league_trends_v4()
-        def_debug = get_defensive_rankings_v4()
+        trends, injuries, def_debug, impact_out = get_dashboard_bundle()
         
         c1, c2 = st.columns(2)
         c1.metric("Injuries", len(injuries))
@@ -295,15 +528,9 @@ with tab1:
         st.header("🌞 Morning Briefing")
         
         with st.expander("⚠️ Impact Players OUT", expanded=False):
-            found_impact = False
-            if not trends.empty:
-                impact_names = trends[trends['Season PPG'] > 12]['Player'].tolist()
-                for star in impact_names:
-                    for injured_name, status in injuries.items():
-                        if star in injured_name:
-                            st.error(f"**{star}**: {status}")
-                            found_impact = True
-            if not found_impact: st.success("✅ No impact players out.")
+            for star, status in impact_out:
+                st.error(f"**{star}**: {status}")
+            if not impact_out: st.success("✅ No impact players out.")
     
     st.subheader("🔥 Trends (Top Scorers)")
     if not trends.empty:
@@ -311,7 +538,9 @@ with tab1:
     else:
         st.warning("⚠️ Market Data Unavailable.")
 
-with tab2:
+# Fragment: sending a chat message reruns only the chat, not the sidebar/dashboard above
+@st.fragment
+def render_chat_tab():
     st.header("CourtVision IQ Chat")
     
     if gemini_error:
@@ -343,19 +572,10 @@ with tab2:
                     games_str += "No games data available today.\n"
                 
                 trends = get_league_trends_v4()
-                injuries = get_live_injuries_v4()
-                
-                # Trim trends to readable format
-                trends_trimmed = ""
-                if not trends.empty:
-                    top_trends = trends.head(20)
-                    trends_trimmed = "Top 20 Trends (Player | Matchup | Season PRA | Last 5 PRA | PRA Delta | Status):\n"
-                    for _, row in top_trends.iterrows():
-                        trends_trimmed += f"{row['Player']} | {row['Matchup']} | {row['Season PRA']:.1f} | {row['Last 5 PRA']:.1f} | {row['PRA Delta']:+.1f} | {row['Status']}\n"
-                else:
-                    trends_trimmed = "No trends data available.\n"
                 
-                context = f"{games_str}\n\nTRENDS DATA (top 20):\n{trends_trimmed}\n\nINJURIES:\n{injuries}"
+                # Compact CSV context, narrowed to the game of any team named in the question
+                focus = get_focus_teams(prompt, todays_games, get_defensive_rankings_v4())
+                trends_label, trends_trimmed, injuries_str = build_chat_context(trends, get_injuries_frame_v4(get_live_injuries_v4()), focus)
                 
                 final_prompt = f"""You are a sharp NBA betting analyst. FOLLOW THESE RULES STRICTLY - NO EXCEPTIONS:
 1. TODAY'S SCHEDULE IS GROUND TRUTH - ALWAYS use it FIRST for any matchup, game, or opponent reference. IGNORE all news, articles, or internal knowledge from yesterday or earlier.
@@ -367,11 +587,11 @@ with tab2:
 TODAY'S SCHEDULE (REPEAT THIS IN YOUR ANSWER):
 {games_str}
 
-TRENDS DATA (top 20):
+TRENDS DATA ({trends_label}):
 {trends_trimmed}
 
 INJURIES:
-{injuries}
+{injuries_str}
 
 QUESTION: {prompt}"""
                 
@@ -381,6 +601,9 @@ QUESTION: {prompt}"""
                 st.markdown(reply or "No reply received - check Gemini key or prompt.")
             st.session_state.messages.append({"role": "assistant", "content": reply})
 
+with tab2:
+    render_chat_tab()
+
 
 
 